@@ -1,14 +1,47 @@
 from credentials import creds
 from zenpy import Zenpy
+from zenpy.lib.exception import APIException, ZenpyException
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestConnectionError, RequestException, Timeout
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from math import ceil
 from textwrap import wrap
 from datetime import datetime
-from time import sleep
+from time import monotonic, sleep
+from io import StringIO
+from queue import Full, Queue
+from random import uniform
+from threading import Event, Thread
+import json
+import os
+import sys
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ticket_cache.json")
+PAGE_SIZE = 100     # tickets requested per page of the Zendesk API (the maximum allowed)
+RETRY_ATTEMPTS = 5  # attempts at a Zendesk API call before get_tickets() gives up
+MAX_RETRY_DELAY = 30    # longest backoff in seconds between attempts, unless Zendesk asks for longer
+POOL_CONNECTIONS = 4    # connection pools kept by the HTTP session of the Zenpy client
+POOL_MAXSIZE = 8    # keep-alive connections kept open in each pool
+SEARCH_CACHE_SIZE = 128     # search terms cached per field by _search_text()
+WRAP_CACHE_SIZE = 1024      # wrapped subjects and descriptions kept by wrap_lines()
+GRAM_SIZE = 3   # length of the character n-grams used to index subject and description text
+REINDEX_SHARE = 0.05    # share of changed tickets above which the search indexes are rebuilt on the next search
+MAX_WIDTH = 70  # ticket display format for page width; default = 70
+TICKET_BREAK = MAX_WIDTH * "_"      # line break between tickets matches MAX_WIDTH
+DESIRED_FIELDS = ("requester_id", "assignee_id", "subject", "description", "tags")
+# This tuple of DESIRED_FIELDS could be used to create another feature where the user adds
+# fields to their ticket display. Given the tickets.json file for this challenge, I selected
+# only those fields for the ticket display that were populated with (non-default) data.
 
 
 class ZendeskTicket:
     """
-    This class creates a Zendesk ticket object with four
-    private data members. This ticket object uses the Zenpy
+    This class creates a Zendesk ticket object whose private
+    data members hold the tickets, their search indexes, and
+    the state of the last API call. This ticket object uses the Zenpy
     library to call the Zendesk API and populate a "tickets"
     data member with a python dictionary representing all
     Zendesk tickets associated with the user's account.
@@ -25,39 +58,347 @@ class ZendeskTicket:
         All data members are private. The "tickets" data member
         is populated by a python dictionary representing all available
         tickets on the user's account. The key is the ticket ID number
-        and the value is a ticket dictionary object (including all possible
-        data fields with their default values). Search_results and tags are initialized
+        and the value is a ticket dictionary object holding the DESIRED_FIELDS
+        of the ticket and its API call timestamp. Search_results and tags are initialized
         as None, and the page_display is set to a default value of 25 tickets
-        per page.
+        per page. The search indexes (casefolded subject and description text, the subject
+        n-gram index, and the tag_index) are built from the "tickets" data member by
+        _build_indexes() on the first search, and indexed_tickets records which tickets
+        dictionary they were built from.
+        The positions data member numbers the tickets in ticket order, so that the index
+        posting lists can be kept in that order as tickets change, and next_position is
+        the number given to the next new ticket.
+        The search_cache holds the results of recent subject and description searches.
+        The last_sync data member holds the epoch time, by Zendesk's clock, up to which tickets
+        have been received, so that later calls only request the tickets that have changed since then. The client data member
+        holds the Zenpy client once it has been created by _get_client(). The fetched_at data
+        member holds the monotonic time of the last successful API call, and ttl is the number
+        of seconds for which that local data is considered fresh by get_tickets().
         """
         self._tickets = None
         self._search_results = None
         self._tags = None
         self._page_display = 25
+        self._subject_lower = None
+        self._description_lower = None
+        self._subject_index = None
+        self._tag_index = None
+        self._indexed_tickets = None
+        self._positions = None
+        self._next_position = 0
+        self._search_cache = None
+        self._last_sync = None
+        self._client = None
+        self._fetched_at = None
+        self._ttl = 300
 
-    def get_tickets(self):
+    def get_tickets(self, force=False):
         """
         This method calls the Zendesk API using the Zenpy library.
-        This method saves all current ticket data associated with the user's
-        account to the "tickets" data member. This method overwrites local data.
-        A Zendesk API Call datatime object is added to every ticket so that the user
+        If the local data was fetched less than "ttl" seconds ago, this method returns
+        without an API call, unless the optional force parameter is True.
+        The first call saves all current ticket data associated with the user's
+        account to the "tickets" data member. Later calls use the Zendesk incremental
+        export to request only the tickets created, updated, or deleted since the last
+        successful call, and merge them into the local data.
+        A Zendesk API Call datatime object is added to every fetched ticket so that the user
         can judge the required frequency of their API call requests based on the age
-        of local data.
+        of local data. Rate limit (429) and server (5xx) errors and dropped connections
+        are retried up to RETRY_ATTEMPTS times, waiting as given by retry_delay() after telling the
+        user how long the wait is. If the API call
+        still fails, the existing local data is kept and the user is informed with a message.
+        On the first call, tickets saved in the local cache file by a previous run are loaded
+        so that only the tickets changed since that run are requested; the cache file is
+        rewritten after every successful call.
+        """
+        if not force and self._fetched_at is not None and monotonic() - self._fetched_at < self._ttl:
+            return
+        if self._tickets is None:
+            self._load_cache()
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                self._sync_tickets()
+                self._fetched_at = monotonic()
+                self._save_cache()
+                return
+            except (APIException, ZenpyException, RequestException) as exception:    # APIException is not a ZenpyException
+                if attempt + 1 < RETRY_ATTEMPTS and is_transient(exception):
+                    delay = retry_delay(exception, attempt)
+                    print(f"The Zendesk API call failed; retrying in {ceil(delay)} seconds.")
+                    sleep(delay)
+                    continue
+                self._client = None         # a failed client is rebuilt on the next call
+                if self._tickets is None:
+                    self._tickets = {}
+                print("An exception has occurred. Please check your login credentials and try again.")
+                # Login credentials must be entered in the associated credentials.py file and
+                # email/password authentication must be enabled on the user's Zendesk admin account.
+                return
+
+    def invalidate(self):
+        """
+        This method marks the local ticket data as stale, so that the next call of
+        get_tickets() makes an API call even within the "ttl" period. Returns nothing.
+        """
+        self._fetched_at = None
+
+    def _sync_tickets(self):
+        """
+        This method makes a single attempt at the Zendesk API call for get_tickets().
+        Fetched tickets are merged into a copy of the local data, and the "tickets"
+        data member is only replaced once every page has been received, so an exception
+        raised part way through leaves the local data unchanged. Returns nothing.
+        """
+        # A datetime object is added to every ticket because incremental updates only
+        # refresh the tickets that changed, so the timestamps on the tickets are staggered
+        # between API calls; tickets received by the same API call share one timestamp.
+        full_sync = self._tickets is None or self._last_sync is None
+        previous = self._tickets
+        tickets = {} if full_sync else dict(previous)
+        changed_ids = {}    # ids created, updated, or deleted by this API call, in the order received
+        latest_update = ""     # the newest updated_at of a full listing, in Zendesk's ISO 8601 format
+        listing_started = monotonic()
+        api_time = datetime.now()       # one timestamp for every ticket received by this API call
+        api_timestamp = format_API_timestamp(api_time)
+        zenpy_client = self._get_client()
+        if full_sync:       # cursor pagination avoids the offset limits on large accounts
+            updates = zenpy_client.tickets(type='ticket', cursor_pagination=PAGE_SIZE)
+        else:   # last_sync is Zendesk's own time, so a minute before it is always a valid start time
+            updates = zenpy_client.tickets.incremental(start_time=self._last_sync - 60)
+        for ticket in prefetch(updates):    # the next pages download while this loop converts tickets
+            changed_ids[ticket.id] = None
+            if ticket.status == "deleted":
+                tickets[ticket.id] = None   # removed below, so a ticket restored later in this call keeps its place
+            else:
+                data = ticket.to_dict()     # keep only the fields the viewer displays and searches
+                if full_sync:
+                    latest_update = max(latest_update, data.get("updated_at") or "")
+                tickets[ticket.id] = {**{key: data[key] for key in DESIRED_FIELDS},
+                                      "API": api_time, "API_timestamp": api_timestamp}
+        for id in changed_ids:
+            if tickets[id] is None:
+                del tickets[id]
+        self._tickets = tickets
+        self._tags = None   # prevents incorrect tags references in local data
+        if not full_sync:
+            # the export reports where it stopped in Zendesk's time, which the local clock may not match
+            self._last_sync = getattr(updates, "end_time", None) or self._last_sync
+        elif latest_update:
+            # a ticket updated during the listing was updated no earlier than the newest update
+            # seen, less the time the listing took, so the next export starts from there
+            newest = datetime.fromisoformat(latest_update.replace("Z", "+00:00")).timestamp()
+            self._last_sync = int(newest - (monotonic() - listing_started))
+        # indexes built by an earlier search are kept up to date; otherwise, _check_indexes()
+        # builds them on the next search, so a refresh never waits on a full index build
+        if not full_sync and self._indexed_tickets is previous and len(changed_ids) <= REINDEX_SHARE * len(tickets):
+            self._update_indexes(previous, changed_ids)     # only the changed tickets are reindexed
+
+    def _load_cache(self):
+        """
+        This method restores the "tickets" and "last_sync" data members from the local
+        cache file written by _save_cache(). A cache file that is missing, unreadable, or
+        was written for a different Zendesk subdomain or a different list of DESIRED_FIELDS
+        is ignored, so that every ticket is fetched again. Called by get_tickets().
+        """
+        try:
+            with open(CACHE_FILE, encoding="utf-8") as file:
+                cache = json.load(file)
+            if cache["subdomain"] != creds["subdomain"] or cache["fields"] != list(DESIRED_FIELDS):
+                return
+            tickets = {}
+            for id, ticket in cache["tickets"].items():     # json stores ticket ids as strings
+                ticket["API"] = datetime.fromisoformat(ticket["API"])
+                tickets[int(id)] = ticket
+            last_sync = cache["last_sync"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        self._tickets = tickets
+        self._last_sync = last_sync
+
+    def _save_cache(self):
+        """
+        This method writes the "tickets" and "last_sync" data members to the local
+        cache file as json, so that the next run of the viewer only requests the tickets
+        that have changed. The file is written under a temporary name and then renamed,
+        so an interrupted write never leaves a partial cache. A cache that cannot be
+        written is skipped, since it only saves time on the next run. Called by get_tickets().
         """
-        # A datetime object is added to every ticket because editing & adding tickets
-        # are features that could be added to this program and these features would
-        # cause staggered timestamps on the tickets. Currently they are all the same timestamp.
+        cache = {
+            "subdomain": creds["subdomain"],
+            "fields": list(DESIRED_FIELDS),     # cached tickets only hold these fields
+            "last_sync": self._last_sync,
+            "tickets": {id: dict(ticket, API=ticket["API"].isoformat()) for id, ticket in self._tickets.items()}
+        }
+        temporary = CACHE_FILE + ".tmp"
         try:
-            self._tickets = {}
-            self._tags = None   # prevents incorrect tags references in local data
-            zenpy_client = Zenpy(**creds)
-            for ticket in zenpy_client.tickets(type='ticket'):
-                self._tickets[ticket.id] = ticket.to_dict()
-                self._tickets[ticket.id]["API"] = datetime.now()
-        except:
-            print("An exception has occurred. Please check your login credentials and try again.")
-            # Login credentials must be entered in the associated credentials.py file and
-            # email/password authentication must be enabled on the user's Zendesk admin account.
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(cache, file, default=str)
+            os.replace(temporary, CACHE_FILE)
+        except OSError:
+            pass
+
+    def _get_client(self):
+        """
+        This method returns the Zenpy client used for Zendesk API calls. The client is
+        created on the first call and reused afterwards, so that its HTTP session and
+        open connections are kept between ticket refreshes. The session is given its own
+        connection pool so that the pages of a listing are fetched over kept-alive
+        connections rather than a new TLS handshake each. Called by get_tickets().
+        """
+        if self._client is None:
+            session = Session()
+            # keep the retry policy (413 and 503 responses, dropped connections) Zenpy sets on its own sessions
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                                  **Zenpy.http_adapter_kwargs())
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._client = Zenpy(session=session, **creds)
+        return self._client
+
+    def _build_indexes(self):
+        """
+        This method builds the search indexes for the tickets stored in the
+        "tickets" data member. Subjects and descriptions are casefolded (an aggressive
+        lowercase for caseless matching) once here instead of on every search. Each short
+        subject is also indexed by its character n-grams, so that a subject search only
+        checks the tickets that contain every piece of the search term; descriptions are
+        too long to index cheaply and are scanned instead. The tag_index maps each
+        tag to a list of the ticket ID numbers that carry that tag, in ticket order,
+        so that a tag search is a single dictionary lookup instead of a scan of every
+        ticket. The index posting lists follow the order of the positions data member.
+        This method is called by _check_indexes() before the first search.
+        """
+        self._positions = {id: position for position, id in enumerate(self._tickets)}
+        self._next_position = len(self._positions)
+        self._subject_lower = {}
+        self._description_lower = {}
+        self._subject_index = defaultdict(list)
+        self._tag_index = defaultdict(list)
+        for id, ticket in self._tickets.items():
+            subject = (ticket["subject"] or "").casefold()  # a ticket may have no subject or description
+            description = (ticket["description"] or "").casefold()
+            self._subject_lower[id] = subject
+            self._description_lower[id] = description
+            for gram in ngrams(subject):
+                self._subject_index[gram].append(id)
+            for tag in set(ticket["tags"]):     # a ticket is listed once per tag
+                self._tag_index[tag].append(id)
+        self._indexed_tickets = self._tickets
+        self._search_cache = {"subject": {}, "description": {}}    # cached results refer to the old tickets
+
+    def _update_indexes(self, previous, changed_ids):
+        """
+        This method accepts the tickets dictionary that the search indexes were built from
+        and the ticket ID numbers that an incremental API call created, updated, or deleted
+        (in the order received), and brings the indexes up to date with the "tickets" data
+        member. Only the index entries of the changed tickets are touched, so a refresh that
+        returns few (or no) changes does not reindex every ticket. New tickets are placed
+        after all existing tickets, which keeps the posting lists in ticket order.
+        A cached search result is dropped only if its search term is found in the old or
+        new text of a changed ticket; the results of every other search term are unchanged.
+        Called by get_tickets() after an incremental API call. Returns nothing.
+        """
+        tickets = self._tickets
+        positions = self._positions
+        changed_text = {"subject": [], "description": []}   # old and new text of the changed tickets
+        for id in changed_ids:
+            old_ticket = previous.get(id)
+            new_ticket = tickets.get(id)
+            if old_ticket is None and new_ticket is None:
+                continue        # a ticket created and deleted between API calls was never indexed
+            if old_ticket is None:
+                positions[id] = self._next_position
+                self._next_position += 1
+            for field, lowered, index in (("subject", self._subject_lower, self._subject_index),
+                                          ("description", self._description_lower, None)):
+                old_text = lowered[id] if old_ticket is not None else ""
+                if new_ticket is None:
+                    del lowered[id]
+                    new_text = ""
+                else:
+                    new_text = lowered[id] = (new_ticket[field] or "").casefold()  # an updated ticket keeps its place
+                changed_text[field] += (old_text, new_text)
+                if index is None:       # descriptions have no n-gram index
+                    continue
+                old_grams = ngrams(old_text)
+                new_grams = ngrams(new_text)
+                for gram in old_grams - new_grams:
+                    remove_posting(index, gram, id, positions)
+                for gram in new_grams - old_grams:
+                    add_posting(index, gram, id, positions)
+            old_tags = set(old_ticket["tags"]) if old_ticket is not None else set()
+            new_tags = set(new_ticket["tags"]) if new_ticket is not None else set()
+            for tag in old_tags - new_tags:
+                remove_posting(self._tag_index, tag, id, positions)
+            for tag in new_tags - old_tags:
+                add_posting(self._tag_index, tag, id, positions)
+            if new_ticket is None:
+                del positions[id]
+        self._indexed_tickets = tickets
+        for field, texts in changed_text.items():
+            cache = self._search_cache[field]
+            for search_term in [term for term in cache if any(term in text for text in texts)]:
+                del cache[search_term]
+
+    def _check_indexes(self):
+        """
+        This method rebuilds the search indexes if the "tickets" data member has been
+        replaced since the indexes were last built. This method is called by the search
+        methods before they read the indexes. Returns nothing.
+        """
+        if self._indexed_tickets is not self._tickets:
+            self._build_indexes()
+
+    def _match_text(self, lowered, index, search_term, candidates=None):
+        """
+        This method accepts a dictionary of casefolded ticket text keyed by ticket ID number,
+        the n-gram index built from that text (or None for text without one), and a search_term,
+        which is casefolded here. The shortest posting list among the n-grams of the search
+        term holds every ticket that could contain the term, so only those tickets are
+        checked with a substring test. Without an index, or for search terms shorter than
+        GRAM_SIZE, every ticket is checked. An optional
+        list of candidates known to hold every match (in ticket order) is used instead
+        when it is shorter. Returns a list of the matching ticket ID numbers in ticket order.
+        """
+        search_term = search_term.casefold()
+        if index is not None and len(search_term) >= GRAM_SIZE:
+            shortest = min((index.get(gram, ()) for gram in ngrams(search_term)), key=len)
+            if candidates is None or len(shortest) < len(candidates):
+                candidates = shortest
+        elif candidates is None:    # no index applies: scan every ticket's text in one pass
+            return [id for id, text in lowered.items() if search_term in text]
+        return [id for id in candidates if search_term in lowered[id]]
+
+    def _search_text(self, field, search_term):
+        """
+        This method accepts a field name ("subject" or "description") and a search_term
+        and returns a list of the ticket ID numbers whose field contains the search term.
+        Results are cached per field and search term until the indexes are rebuilt, or a
+        changed ticket contains the search term, so a repeated search is a single dictionary
+        lookup. When the search term extends an earlier cached search term, only the earlier
+        matches need to be checked, since any text containing the longer term also contains
+        the shorter one.
+        Called by search_subject() and search_description().
+        """
+        self._check_indexes()
+        if field == "subject":
+            lowered, index = self._subject_lower, self._subject_index
+        else:
+            lowered, index = self._description_lower, None     # descriptions are scanned
+        cache = self._search_cache[field]
+        search_term = search_term.casefold()
+        matches = cache.get(search_term)
+        if matches is None:
+            previous = None
+            for end in range(len(search_term) - 1, 0, -1):     # longest cached prefix first
+                previous = cache.get(search_term[:end])
+                if previous is not None:
+                    break
+            matches = self._match_text(lowered, index, search_term, previous)
+            if len(cache) >= SEARCH_CACHE_SIZE:
+                del cache[next(iter(cache))]                     # drop the oldest cached search
+            cache[search_term] = matches
+        return list(matches)    # copy so the cache is never shared
 
     def get_ticket_data(self):
         """
@@ -87,8 +428,8 @@ class ZendeskTicket:
     def get_search_results(self):
         """
         This method allows access to the private data member "search_results"
-        from outside the ZendeskTicket class. Returns a dictionary of tickets
-        or None.
+        from outside the ZendeskTicket class. Returns a list of the ticket ID numbers
+        matched by the last search, in ticket order, or None.
         """
         return self._search_results
 
@@ -102,20 +443,16 @@ class ZendeskTicket:
         in parentheses. If there are no tags associated with the tickets, this method
         informs the user with a message and returns.
         """
-        all_tags = []
-        for id in self._tickets:
-            for tag in self._tickets[id]["tags"]:
-                all_tags.append(tag)        # append all tags to a list
-        tags = sorted(set(all_tags))        # create a set of the list of tags to find all unique tags
-        if len(tags) == 0:                  # handle edge case where user has not applied tags to tickets
+        counter = Counter()                 # single pass tally of every tag applied to every ticket
+        for ticket in self._tickets.values():
+            counter.update(ticket["tags"])
+        if len(counter) == 0:               # handle edge case where user has not applied tags to tickets
             print("There are no tags associated with your Zendesk tickets.")
             return
         else:
-            tags_dict = {}                  # dictionary structure allows recording of tag as key with count as value
-            for tag in tags:                # iterate through tags set to create key, and count the presence of tag in all_tags
-                tags_dict[tag] = all_tags.count(tag)
+            tags_dict = dict(sorted(counter.items()))   # tag as key with count as value, in alphabetical order
             self._tags = tags_dict          # updates tags data member
-            number = len(tags)
+            number = len(tags_dict)
             print("\n", end="")
             print(f"There are {number} unique tags applied to your tickets.")
             print("\n", end="")             # report the number of unique tags to the user
@@ -135,11 +472,15 @@ class ZendeskTicket:
         and returns a timestamp message to be displayed at the bottom
         of the ticket display for each ticket. This method is applied to each
         ticket so that future features like ticket editing, or ticket addition
-        will allow for staggered API call timestamps. This method is
+        will allow for staggered API call timestamps. The message is formatted
+        once by get_tickets() and stored in the ticket's "API_timestamp" field;
+        tickets without that field are formatted here. This method is
         called by display_tickets().
         """
-        message = "Zendesk API Called: "
-        timestamp = f"{message}{self._tickets[id]['API']}"
+        ticket = self._tickets[id]
+        timestamp = ticket.get("API_timestamp")
+        if timestamp is None:
+            timestamp = format_API_timestamp(ticket["API"])
         return timestamp
 
     def display_tickets(self):
@@ -155,130 +496,111 @@ class ZendeskTicket:
         """
         if self._tickets is not None and len(self._tickets) != 0:
             page = self._page_display
-            max_width = 70      # ticket display format for page width; default = 70
-            count = 0
             if self._search_results is None:    # give precedence to search_results over display of all tickets
-                tickets = self._tickets
+                id_list = list(self._tickets)   # used to index ticket id numbers for descriptive user messages
             else:
-                tickets = self._search_results
-            total = len(tickets)                # capture total number of tickets
-            desired_fields = ["requester_id", "assignee_id", "subject", "description", "tags"]
-            # This list of desired_fields could be used to create another feature where the user adds
-            # fields to their ticket display. Given the tickets.json file for this challenge, I selected
-            # only those fields for the ticket display that were populated with (non-default) data.
-            ticket_break = max_width * "_"      # dynamically updates line break to match max_width
-            print(ticket_break)
-            for id in tickets:
-                print(f"[Ticket ID #{id}]")     # key value for python ticket dictionary
-                count += 1
-                for key in desired_fields:
-                    key_text = format_key_display(key)      # format presentation of each key for pretty printing
-                    print(f"{key_text}", end="")
-                    if type(tickets[id][key]) is str:
-                        if key == "description":            # handle the large text block of description
-                            print("\n", end="")             # by inserting a new line to preserve maxwidth
-                        text = wrap(tickets[id][key], width=max_width)
-                        for line in text:
-                            print(line)
-                        print("\n", end="")
-                    elif type(tickets[id][key]) is list:    # formats data that is received as a list; Ex. Tags
-                        for item in tickets[id][key]:
-                            if item == list(tickets[id][key])[-1]:  # formats printing of list as comma separated values
-                                print(f"{item} ", end="")           # prevents comma placement at end of list
-                            else:
-                                print(f"{item}, ", end="")
-                    else:                                   # not a string or a list, print the integer
-                        print(tickets[id][key])
-                print("\n", "\n", end="")
-                print(self.add_API_timestamp(id))           # add timestamp of every API call to the ticket display
-                print(ticket_break)
-                id_list = list(tickets)                     # used to index ticket id numbers for descriptive user messages
-                if count % page == 0:                       # tracks the pagination of ticket displays
-                    if page == 1:
-                        print(f"Ticket #{id} is displayed out of {total} tickets.")
+                id_list = self._search_results
+            total = len(id_list)                # capture total number of tickets
+            buf = StringIO()                    # each page is written to one buffer and emitted before the user prompt
+            buf.write(TICKET_BREAK + "\n")
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                next_page = executor.submit(self._format_page, id_list[:page])
+                for start in range(0, total, page):
+                    end = start + page
+                    buf.write(next_page.result())
+                    if end < total:     # the next page is formatted while the user reads this one
+                        next_page = executor.submit(self._format_page, id_list[end:end + page])
+                    if end <= total:                        # tracks the pagination of ticket displays
+                        if page == 1:
+                            buf.write(f"Ticket #{id_list[start]} is displayed out of {total} tickets.\n")
+                        else:
+                            buf.write(f"Tickets #{id_list[start]} through #{id_list[end - 1]} "
+                                      f"are displayed out of {total} tickets.\n")
+                        if end == total:
+                            buf.write("This is the end of the ticket display.\n")
+                            buf.write("Press <RETURN> to exit the display function.\n")
+                            emit(buf)
+                            input()
+                        else:
+                            buf.write(
+                                "Press <RETURN> to display the next batch of tickets -or- enter 'Q' to leave the ticket display.\n")
+                            emit(buf)
+                            user_input = input().lower()
+                            if user_input == 'q':
+                                print("\n", end="")
+                                return
+                if total < page:            # if fewer tickets are being displayed than the pagination value
+                    if total == 1:          # and the last ticket has been printed, display message
+                        buf.write(f"There is {total} ticket displayed.\n")
                     else:
-                        print(
-                            f"Tickets #{id_list[id_list.index(id) - (page - 1)]} through #{id} are displayed out of {total} tickets.")
-                    if list(tickets)[-1] == id:
-                        print("This is the end of the ticket display.")
-                        print("Press <RETURN> to exit the display function.")
-                        input()
-                    else:
-                        print(
-                            "Press <RETURN> to display the next batch of tickets -or- enter 'Q' to leave the ticket display.")
-                        user_input = input().lower()
-                        if user_input == 'q':
-                            print("\n", end="")
-                            return
-                if total < page and total == count:     # if fewer tickets are being displayed than the pagination value
-                    if total == 1:                      # and the last ticket has been printed, display message
-                        print(f"There is {total} ticket displayed.")
-                        print("\n", end="")
-                    else:
-                        print(f"There are {total} tickets displayed.")
-                        print("\n", end="")
+                        buf.write(f"There are {total} tickets displayed.\n")
+                    buf.write("\n")
+            emit(buf)                                   # write any tickets left after the last full page
             self._search_results = None                 # restore search_results data member to None
 
-    def search_subject(self, search_term):
+    def _format_page(self, id_list):
         """
-        This method accepts a search_term as a parameter and searches
-        all ticket subject fields for the search term. This method updates
+        This method accepts a list of ticket ids as a parameter and returns the display
+        text of those tickets as a single string, each ticket filled into TICKET_TEMPLATE.
+        display_tickets() calls this method on a worker thread to format the next page
+        of tickets while the user is still reading the current one.
+        """
+        tickets = self._tickets
+        displays = []
+        for id in id_list:
+            ticket = tickets[id]    # key value for python ticket dictionary
+            displays.append(TICKET_TEMPLATE.format(
+                id=id,
+                timestamp=self.add_API_timestamp(id),   # add timestamp of every API call to the ticket display
+                **{key: render(ticket[key], MAX_WIDTH) for key, render in FIELD_RENDERERS.items()}))
+        return "".join(displays)
+
+    def search(self, field, search_term):
+        """
+        This method accepts a field name ("subject", "description", or "tags") and a
+        search_term as parameters and searches that field of all tickets for the search term.
+        Subject and description searches match the search term anywhere in the text,
+        regardless of case; tag searches match a whole tag. This method updates
         the "search_results" data member with the search_results, if there are any,
         otherwise it displays a descriptive message for the user and returns.
         Given search_results, this method displays the number of tickets that
-        contain the search term in the subject field.
+        contain the search term in the field.
         """
-        search_results = {}
-        for ticket in self._tickets:    # the search methods could be made to be modular by passing a parameter with a string
-            if search_term in self._tickets[ticket]["subject"].lower():  # for the desired search field
-                search_results[ticket] = self._tickets[ticket]           # given more time, that would be my choice
-        total = len(search_results)                                      # in addition to offering multiple field searches
+        if field == "tags":
+            self._check_indexes()
+            matches = list(self._tag_index.get(search_term, ()))   # copy so the index is never shared
+            label = "tag"
+        else:
+            matches = self._search_text(field, search_term)
+            label = field
+        total = len(matches)
         if total == 0:
-            print(f"There are no results that match your subject search for: {search_term}")
+            print(f"There are no results that match your {label} search for: {search_term}")
         else:
-            print(f"There are {total} tickets that match your subject search for: {search_term}")
-            sleep(2)
-            self._search_results = search_results   # search_results have precedence so, only update data member if
+            print(f"There are {total} tickets that match your {label} search for: {search_term}", flush=True)
+            self._search_results = matches  # search_results have precedence so, only update data member if
+                                            # search_results exist
+
+    def search_subject(self, search_term):
+        """
+        This method accepts a search_term as a parameter and searches
+        all ticket subject fields for the search term using search().
+        """
+        self.search("subject", search_term)
 
     def search_description(self, search_term):
         """
         This method accepts a search_term as a parameter and searches
-        all ticket description fields for the search term. This method updates
-        the "search_results" data member with the search_results, if there are any,
-        otherwise it displays a descriptive message for the user and returns.
-        Given search_results, this method displays the number of tickets that
-        contain the search term in the description field.
+        all ticket description fields for the search term using search().
         """
-        search_results = {}             # clone of search_subject for description field
-        for ticket in self._tickets:
-            if search_term in self._tickets[ticket]["description"].lower():
-                search_results[ticket] = self._tickets[ticket]
-        total = len(search_results)
-        if total == 0:
-            print(f"There are no results that match your description search for: {search_term}")
-        else:
-            print(f"There are {total} tickets that match your description search for: {search_term}")
-            sleep(2)
-            self._search_results = search_results   # only update data member if search_results exist
+        self.search("description", search_term)
 
     def search_tags(self, search_term):
-        """This method accepts a search_term as a parameter and searches
-        all ticket tags for the search term. This method updates
-        the "search_results" data member with the search_results, if there are any,
-        otherwise it displays a descriptive message for the user and returns.
-        Given search_results, this method displays the number of tickets that
-        contain the search term in the tags field."""
-        search_results = {}
-        for ticket in self._tickets:
-            if search_term in self._tickets[ticket]["tags"]:
-                search_results[ticket] = self._tickets[ticket]      # construct dictionary output to fit parameters
-        total = len(search_results)                                 # of display_tickets()
-        if total == 0:
-            print(f"There are no results that match your tag search for: {search_term}")
-        else:
-            print(f"There are {total} tickets that match your tag search for: {search_term}")
-            sleep(2)
-            self._search_results = search_results   # only update data member if search_results exist
+        """
+        This method accepts a search_term as a parameter and searches
+        all ticket tags for the search term using search().
+        """
+        self.search("tags", search_term)
 
     def search_ticket_id(self, id_number):
         """
@@ -286,22 +608,79 @@ class ZendeskTicket:
         all tickets for the ID number. This method updates
         the "search_results" data member with the search_results, if there are any,
         otherwise it displays a descriptive message for the user and returns.
-        The id_number is validated in main() to fall in the range of available ticket IDs.
+        The id_number is validated in main() to be the ID of an available ticket.
         This choice of external validation allows for re-prompting of the user for valid input.
         Given search_results, this method displays when the ticket has been found.
         """
-        search_results = {}
-        try:
-            search_results[id_number] = self._tickets[id_number]
-        except KeyError:        # should an id number be passed that triggers a dictionary KeyError
+        if self._tickets.get(id_number) is None:    # should an id number be passed that is not a ticket
             print(f"Ticket #{id_number} cannot be found.")
-        total = len(search_results)
-        if total == 0:
-            print(f"There are no results that match your ticket ID search for #{id_number}.")
+            return
+        print(f"Ticket #{id_number} has been retrieved.", flush=True)
+        self._search_results = [id_number]          # only update data member if search_results exist
+
+
+def ngrams(text):
+    """
+    This function accepts a casefolded string and returns the set of its character
+    n-grams of length GRAM_SIZE; text shorter than GRAM_SIZE has none. Used to build,
+    update, and search the subject and description indexes of the ZendeskTicket class.
+    """
+    return set(text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1))
+
+
+def posting_slot(posting, id, positions):
+    """
+    This function accepts a posting list of ticket ID numbers in ticket order, a ticket
+    ID number, and the dictionary of ticket positions, and returns the index in the posting
+    list where that ticket is, or would be inserted, found by binary search.
+    Called by add_posting() and remove_posting().
+    """
+    position = positions[id]
+    low, high = 0, len(posting)
+    while low < high:
+        middle = (low + high) // 2
+        if positions[posting[middle]] < position:
+            low = middle + 1
         else:
-            print(f"Ticket #{id_number} has been retrieved.")
-            sleep(2)
-            self._search_results = search_results       # only update data member if search_results exist
+            high = middle
+    return low
+
+
+def add_posting(index, key, id, positions):
+    """
+    This function accepts an index dictionary of posting lists, an index key (an n-gram
+    or a tag), a ticket ID number, and the dictionary of ticket positions, and inserts the
+    ticket into the posting list of that key in ticket order. New tickets are always last,
+    so they are appended without a search. Called by _update_indexes(). Returns nothing.
+    """
+    posting = index[key]
+    if not posting or positions[posting[-1]] < positions[id]:
+        posting.append(id)
+    else:
+        posting.insert(posting_slot(posting, id, positions), id)
+
+
+def remove_posting(index, key, id, positions):
+    """
+    This function accepts an index dictionary of posting lists, an index key (an n-gram
+    or a tag), a ticket ID number, and the dictionary of ticket positions, and removes the
+    ticket from the posting list of that key. A posting list left empty is removed from
+    the index. Called by _update_indexes(). Returns nothing.
+    """
+    posting = index[key]
+    del posting[posting_slot(posting, id, positions)]
+    if not posting:
+        del index[key]
+
+
+def format_API_timestamp(api_time):
+    """
+    This function accepts the datetime object of a Zendesk API call and returns
+    the timestamp message displayed at the bottom of each ticket display.
+    Called by get_tickets() and add_API_timestamp() in the ZendeskTicket class.
+    """
+    message = "Zendesk API Called: "
+    return f"{message}{api_time}"
 
 
 def format_key_display(key):
@@ -313,14 +692,196 @@ def format_key_display(key):
     Returns formatted string.
     """
     offset = 15         # offset value determines the indentation of all data following the printing
-    length = len(key)   # of category fields in the display_tickets() method; does not apply to "description"
-    diff = offset - length
-    space_string = diff * " "
-    key = key.replace("_", " ")
-    key = key.title()
-    key += ":"
-    key += space_string
-    return key
+                        # of category fields in the display_tickets() method; does not apply to "description"
+    label = key.replace("_", " ").title() + ":"
+    return f"{label:<{offset + 1}}"     # pad so the data starts one column past the offset
+
+
+@lru_cache(maxsize=WRAP_CACHE_SIZE)
+def wrap_lines(text, width):
+    """
+    This function accepts a string and a line width and returns the string wrapped
+    to that width as a tuple of lines. Results are cached, so paging back over tickets
+    that have already been displayed does not wrap their text again. Called by render_text().
+    """
+    return tuple(wrap(text, width=width))
+
+
+def render_text(value, max_width):
+    """
+    This function accepts a text field value and the display width. It returns the text
+    wrapped to max_width followed by a blank line. Short single-line text that wrap()
+    would not change is returned directly, skipping the wrap() call. A missing (None)
+    value is rendered like any other scalar. Used for the subject field by display_tickets().
+    """
+    if value is None:
+        return render_scalar(value, max_width)
+    if 0 < len(value) <= max_width and value.isprintable() and not value[-1].isspace():
+        return value + "\n\n"       # fits on one line and wrap() would leave it unchanged
+    return "".join(line + "\n" for line in wrap_lines(value, max_width)) + "\n"
+
+
+def render_description(value, max_width):
+    """
+    This function accepts a description value and the display width. The large text block
+    of the description starts on a new line to preserve max_width, and is otherwise
+    rendered by render_text(). Used by display_tickets().
+    """
+    if value is None:
+        return render_scalar(value, max_width)
+    return "\n" + render_text(value, max_width)
+
+
+def render_list(value, max_width):
+    """
+    This function accepts a list value and the display width (unused). It returns the
+    list as comma separated values, with no comma after the last item, or an empty
+    string for an empty list. Used for the tags field by display_tickets().
+    """
+    if value:
+        return ", ".join(map(str, value)) + " "
+    return ""
+
+
+def render_scalar(value, max_width):
+    """
+    This function accepts a single value such as an ID number and the display width
+    (unused). It returns the value on its own line. Used by display_tickets().
+    """
+    return f"{value}\n"
+
+
+# field headers and renderers are chosen once at import rather than for every ticket displayed
+FIELD_HEADERS = {key: format_key_display(key) for key in DESIRED_FIELDS}
+FIELD_RENDERERS = {
+    "requester_id": render_scalar,
+    "assignee_id": render_scalar,
+    "subject": render_text,
+    "description": render_description,
+    "tags": render_list
+}
+# the display of a single ticket is filled in with one format() call; the rendered fields
+# follow their headers in the order of DESIRED_FIELDS
+TICKET_TEMPLATE = ("[Ticket ID #{id}]\n"
+                   + "".join(f"{FIELD_HEADERS[key]}{{{key}}}" for key in DESIRED_FIELDS)
+                   + "\n \n{timestamp}\n"
+                   + TICKET_BREAK + "\n")
+
+
+def is_transient(exception):
+    """
+    This function accepts an exception raised during a Zendesk API call and returns
+    True if the call is worth retrying: a rate limit (429) or server (5xx) response,
+    or a request that failed without any response because of a dropped connection or
+    a timeout. Errors such as invalid login credentials, or a request that could never
+    be sent (an invalid URL or header), return False. Called by get_tickets().
+    """
+    response = getattr(exception, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(exception, (RequestConnectionError, Timeout))
+
+
+def retry_delay(exception, attempt):
+    """
+    This function accepts the exception raised by a transient Zendesk API call failure
+    and the number of the failed attempt (starting at 0), and returns the number of
+    seconds to wait before retrying. A rate limit response that states how long to wait
+    in its Retry-After header is followed exactly. Otherwise the wait doubles with each
+    attempt up to MAX_RETRY_DELAY, plus up to a second of random jitter so that clients
+    that failed together do not all retry at the same moment. Called by get_tickets().
+    """
+    response = getattr(exception, "response", None)
+    retry_after = str(getattr(response, "headers", None) and response.headers.get("Retry-After", ""))
+    if retry_after.isdigit():
+        return int(retry_after)
+    return min(2 ** attempt, MAX_RETRY_DELAY) + uniform(0, 1)
+
+
+def prefetch(iterable, batch_size=PAGE_SIZE, depth=4):
+    """
+    This function accepts an iterable and yields its items while a background thread
+    keeps pulling the following items into a queue. The Zenpy ticket generators make
+    an HTTP request every batch_size (one page of) tickets, so the next pages are
+    downloaded while get_tickets() converts the current page. At most depth batches are
+    held in the queue. An exception raised by the iterable is re-raised to the caller.
+    If the caller stops early (an exception in its loop, or the generator being closed),
+    the background thread is told to stop and ends after the page it is fetching.
+    """
+    batches = Queue(maxsize=depth)
+    stop = Event()
+    done = object()
+
+    def put(item):      # returns False once the consumer has stopped, instead of blocking forever
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            batch = []
+            for item in iterable:
+                batch.append(item)
+                if len(batch) == batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if put(batch):
+                put(done)
+        except Exception as exception:      # hand the failure to the consuming thread
+            put(exception)
+
+    Thread(target=produce, name="prefetch", daemon=True).start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is done:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        stop.set()
+        while not batches.empty():      # free the queue so a waiting put() returns at once
+            batches.get_nowait()
+
+
+def emit(buf):
+    """
+    This function accepts a StringIO buffer as a parameter and writes its contents
+    to stdout with a single write call. The buffer is then emptied so that it can be
+    reused for the next page of the display_tickets() method in the ZendeskTicket class.
+    Returns nothing.
+    """
+    sys.stdout.write(buf.getvalue())
+    sys.stdout.flush()
+    buf.seek(0)
+    buf.truncate(0)
+
+
+MENU = {
+    1: "Display Tickets",
+    2: "Display Search Tags",
+    3: "Search Tickets by Subject",
+    4: "Search Tickets by Description",
+    5: "Search Tickets by Tag Identifier",
+    6: "Search Tickets by Ticket ID Number",
+    7: "Update Local Tickets from Zendesk API",
+    8: "Change Number of Tickets Displayed Per Page",
+    "Q": "Quit Zendesk Ticket Viewer"
+}
+# the banner and menu are joined once at import and written with a single call by display_menu()
+MENU_DISPLAY = ("\n"
+                "*************************************\n"
+                "Welcome to the Zendesk Ticket Viewer!\n"
+                "*************************************\n"
+                "Please make a selection.\n"
+                + "".join(f"{key} : {value}\n" for key, value in MENU.items()))
 
 
 def display_menu():
@@ -328,39 +889,23 @@ def display_menu():
     This function displays a menu of choices that are methods of the
     ZendeskTicket class. This function is called by main().
     This function validates the user_input, and reprompts the user for alternate
-    input if it cannot validate it. Returns the validated input to main()
-    or an additional call of display_menu() to reprompt the user.
+    input if it cannot validate it. The menu is displayed once; an invalid
+    selection only displays an error message before the user is reprompted.
+    Returns the validated input to main().
     """
     low = 1         # values allow easy updating of int validation
     high = 8
-    print("\n", end="")
-    print("*************************************")
-    print("Welcome to the Zendesk Ticket Viewer!")
-    print("*************************************")
-    print("Please make a selection.")
-    menu = {
-        1: "Display Tickets",
-        2: "Display Search Tags",
-        3: "Search Tickets by Subject",
-        4: "Search Tickets by Description",
-        5: "Search Tickets by Tag Identifier",
-        6: "Search Tickets by Ticket ID Number",
-        7: "Update Local Tickets from Zendesk API",
-        8: "Change Number of Tickets Displayed Per Page",
-        "Q": "Quit Zendesk Ticket Viewer"
-    }
-    for key in menu:                        # input validation could also be as a menu dictionary call
-        print(f"{key} : {menu[key]}")       # in the form of a Try: / Except KeyError:
-    selection = input().strip()             # where the KeyError causes a reprompt of the user
-    if selection.lower() == "q":
-        return selection
-    elif selection.isnumeric() and low <= int(selection) <= high:
-        selection = int(selection)
-        return selection
-    else:
-        print("\n", end="")
-        print("* Invalid selection. Please try again. *")
-        return display_menu()
+    sys.stdout.write(MENU_DISPLAY)
+    while True:
+        selection = input().strip()
+        if selection.lower() == "q":
+            return selection
+        elif selection.isnumeric() and low <= int(selection) <= high:
+            selection = int(selection)
+            return selection
+        else:
+            print("\n", end="")
+            print("* Invalid selection. Please try again. *")
 
 
 if __name__ == "__main__":
@@ -394,25 +939,26 @@ if __name__ == "__main__":
             if zt.get_search_results() is not None:
                 zt.display_tickets()
         elif user_input == 6:  # search tickets by ticket id number
-            ticket_ids = list(zt.get_ticket_data())
-            first_ticket = ticket_ids[0]    # used to validate ticket id number
-            last_ticket = ticket_ids[-1]
+            ticket_data = zt.get_ticket_data()  # ticket ids are validated by dictionary lookup
+            first_ticket = min(ticket_data)     # incremental updates append new tickets out of id order
+            last_ticket = max(ticket_data)
             searching = True
             while searching:
                 print(f"You have Ticket IDs in the range of #{first_ticket} to #{last_ticket}.")
                 print(f"Please enter the * TICKET ID * number.")
                 id_number = input().strip()
-                if id_number.isnumeric() and first_ticket <= int(id_number) <= last_ticket:
+                if id_number.isnumeric() and int(id_number) in ticket_data:
                     searching = False       # if ticket id number is valid, retrieve ticket
                     zt.search_ticket_id(int(id_number))
-                    zt.display_tickets()
+                    if zt.get_search_results() is not None:
+                        zt.display_tickets()
                 elif id_number.lower() == "q":
                     searching = False
                 else:
                     print("\n", end="")
                     print("Invalid entry. Please try again or enter 'Q' to quit.")  # reprompt user
         elif user_input == 7:  # update local tickets from zendesk api
-            zt.get_tickets()
+            zt.get_tickets(force=True)
             print("* Your Zendesk API call was successful! *")
         elif user_input == 8:  # change number of tickets displayed per page scroll
             print(f"You are currently seeing {zt.get_page_display()} ticket(s) per page.")
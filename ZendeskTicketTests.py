@@ -1,5 +1,14 @@
+import itertools
+import os
+import tempfile
+import threading
 import unittest
-from ZendeskCodingChallenge import ZendeskTicket
+from unittest.mock import patch
+import requests.exceptions
+from zenpy.lib.exception import APIException
+import ZendeskCodingChallenge
+from ZendeskCodingChallenge import ZendeskTicket, prefetch, display_menu, is_transient, format_key_display, \
+    retry_delay
 from TestTickets import tickets
 
 
@@ -24,9 +33,12 @@ class UnitTests(unittest.TestCase):
         This test confirms that the "tickets" data member populates via an API
          call with the 100 tickets loaded to the Zendesk account from the tickets.json file.
          This test will fail if the tickets.json data is not first posted to the user's account.
+         The local cache file is written to a temporary directory, so the tickets come from the API call.
          """
         zt = ZendeskTicket()
-        zt.get_tickets()
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.object(ZendeskCodingChallenge, "CACHE_FILE", os.path.join(directory, "cache.json")):
+                zt.get_tickets()
         number_of_tickets = len(zt._tickets)
         self.assertIsNotNone(zt._tickets)
         self.assertEqual(number_of_tickets, 100)
@@ -37,7 +49,9 @@ class UnitTests(unittest.TestCase):
         "tickets" get method produce the same result.
         """
         zt = ZendeskTicket()
-        zt.get_tickets()
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.object(ZendeskCodingChallenge, "CACHE_FILE", os.path.join(directory, "cache.json")):
+                zt.get_tickets()
         self.assertIs(zt._tickets, zt.get_ticket_data())
 
     def test_get_page_display(self):
@@ -80,7 +94,7 @@ class UnitTests(unittest.TestCase):
         num = len(zt._search_results)
         self.assertEqual(num, 1)
         for key in zt._search_results:
-            ticket = zt._search_results[key]
+            ticket = zt._tickets[key]
         self.assertEqual(ticket["subject"], "z is for zen")
 
     def test_search_description(self):
@@ -95,7 +109,7 @@ class UnitTests(unittest.TestCase):
         num = len(zt._search_results)
         self.assertEqual(num, 1)
         for key in zt._search_results:
-            ticket = zt._search_results[key]
+            ticket = zt._tickets[key]
         self.assertEqual(ticket["subject"], "m is for michelle")
 
     def test_search_tags(self):
@@ -110,7 +124,7 @@ class UnitTests(unittest.TestCase):
         num = len(zt._search_results)
         self.assertEqual(num, 1)
         for key in zt._search_results:
-            ticket = zt._search_results[key]
+            ticket = zt._tickets[key]
         self.assertEqual(ticket["subject"], "a is for apple")
 
     def test_search_ticket_id(self):
@@ -125,5 +139,352 @@ class UnitTests(unittest.TestCase):
         num = len(zt._search_results)
         self.assertEqual(num, 1)
         for key in zt._search_results:
-            ticket = zt._search_results[key]
+            ticket = zt._tickets[key]
         self.assertEqual(ticket["description"], "Watch this fruit fall to discover the laws of gravity.")
+
+    def test_build_indexes(self):
+        """
+        This test confirms that given a sample ticket dictionary (attached),
+        the _build_indexes method maps each tag to the ticket ids carrying that tag,
+        in ticket order, and that search_tags returns every ticket for a shared tag.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = tickets
+        zt._build_indexes()
+        self.assertEqual(zt._tag_index["giraffe"], [0, 1, 2])
+        self.assertEqual(zt._tag_index["hippo"], [1])
+        zt.search_tags("giraffe")
+        self.assertEqual(list(zt._search_results), [0, 1, 2])
+
+    def test_update_indexes(self):
+        """
+        This test confirms that given a sample ticket dictionary (attached), the
+        _update_indexes method reindexes only the changed tickets, keeps updated tickets
+        in their place, places new tickets last, and leaves the same indexes that
+        _build_indexes would build for the new tickets.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = dict(tickets)
+        zt._build_indexes()
+        previous = zt._tickets
+        updated = dict(previous)
+        updated[1] = dict(previous[1], subject="z is for zebra", tags=["giraffe", "zebra"])
+        updated[3] = dict(previous[2], subject="n is for new", tags=["giraffe"])
+        del updated[0]
+        zt._tickets = updated
+        zt._update_indexes(previous, {1: None, 0: None, 3: None})
+        self.assertEqual(zt._tag_index["giraffe"], [1, 2, 3])
+        self.assertNotIn("hippo", zt._tag_index)
+        self.assertEqual(zt._match_text(zt._subject_lower, zt._subject_index, "z is"), [1])
+        rebuilt = ZendeskTicket()
+        rebuilt._tickets = updated
+        rebuilt._build_indexes()
+        self.assertEqual(zt._subject_index, rebuilt._subject_index)
+        self.assertEqual(zt._tag_index, rebuilt._tag_index)
+
+    def test_match_text(self):
+        """
+        This test confirms that given a sample ticket dictionary (attached),
+        the _match_text method finds the same tickets as a substring search,
+        including search terms that span words and terms shorter than an n-gram.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = tickets
+        zt._build_indexes()
+        self.assertEqual(zt._match_text(zt._subject_lower, zt._subject_index, "is for"), [0, 1, 2])
+        self.assertEqual(zt._match_text(zt._subject_lower, zt._subject_index, "ppl"), [1])
+        self.assertEqual(zt._match_text(zt._subject_lower, zt._subject_index, "z"), [0])
+        self.assertEqual(zt._match_text(zt._description_lower, None, "discover"), [0, 1])
+        self.assertEqual(zt._match_text(zt._description_lower, None, "xyz"), [])
+
+    def test_prefetch(self):
+        """
+        This test confirms that the prefetch function yields every item of an iterable
+        in order across batch boundaries, and re-raises an exception from the iterable.
+        """
+        self.assertEqual(list(prefetch(range(250), batch_size=100)), list(range(250)))
+
+        def failing():
+            yield 1
+            raise ValueError("page request failed")
+        with self.assertRaises(ValueError):
+            list(prefetch(failing()))
+
+    def test_prefetch_stop(self):
+        """
+        This test confirms that the background thread of the prefetch function ends
+        when the caller stops before the iterable is exhausted.
+        """
+        running = set(threading.enumerate())
+        items = prefetch(itertools.count(), batch_size=1, depth=1)
+        self.assertEqual([next(items) for _ in range(3)], [0, 1, 2])
+        producers = set(threading.enumerate()) - running
+        self.assertEqual(len(producers), 1)
+        items.close()
+        for thread in producers:
+            thread.join(timeout=2)
+            self.assertFalse(thread.is_alive())
+
+    def test_search_subject_caseless(self):
+        """
+        This test confirms that given a sample ticket dictionary (attached),
+        the search_subject method matches the search term regardless of case.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = tickets
+        zt.search_subject("MICHELLE")
+        self.assertEqual(zt._search_results, [2])
+
+    def test_search_ticket_id_missing(self):
+        """
+        This test confirms that given a sample ticket dictionary (attached),
+        and a ticket id that does not exist, the search_ticket_id method
+        leaves the "search_results" data member as None.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = tickets
+        zt.search_ticket_id(42)
+        self.assertIsNone(zt._search_results)
+
+    def test_display_menu(self):
+        """
+        This test confirms that the display_menu function reprompts the user
+        after invalid selections and returns the first valid selection as an int.
+        """
+        with patch("builtins.input", side_effect=["x", "9", "0", " 3 "]):
+            self.assertEqual(display_menu(), 3)
+
+    def test_is_transient(self):
+        """
+        This test confirms that the is_transient function marks rate limit and
+        server error responses, dropped connections, and timeouts for retry, but not
+        authentication failures or requests that could never be sent.
+        """
+        class Response:
+            def __init__(self, status_code):
+                self.status_code = status_code
+        for status, expected in ((429, True), (503, True), (401, False), (404, False)):
+            self.assertEqual(is_transient(APIException("API call failed", response=Response(status))), expected)
+        self.assertTrue(is_transient(requests.exceptions.ConnectionError("connection dropped")))
+        self.assertTrue(is_transient(requests.exceptions.ReadTimeout("no response")))
+        self.assertFalse(is_transient(requests.exceptions.InvalidURL("bad subdomain")))
+        self.assertFalse(is_transient(requests.exceptions.InvalidHeader("bad header")))
+
+    def test_retry_delay(self):
+        """
+        This test confirms that the retry_delay function follows a Retry-After header and
+        otherwise backs off exponentially, with jitter, up to MAX_RETRY_DELAY seconds.
+        """
+        class Response:
+            def __init__(self, headers):
+                self.headers = headers
+        error = Exception()
+        error.response = Response({"Retry-After": "45"})
+        self.assertEqual(retry_delay(error, 0), 45)
+        error.response = Response({})
+        self.assertTrue(4 <= retry_delay(error, 2) <= 5)
+        self.assertTrue(ZendeskCodingChallenge.MAX_RETRY_DELAY <= retry_delay(error, 10)
+                        <= ZendeskCodingChallenge.MAX_RETRY_DELAY + 1)
+
+    def test_search_text_cache(self):
+        """
+        This test confirms that the _search_text method caches results per search term,
+        narrows a longer search term from a cached shorter one, and discards cached
+        results once the "tickets" data member is replaced.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = tickets
+        self.assertEqual(zt._search_text("subject", "is"), [0, 1, 2])
+        self.assertEqual(zt._search_text("subject", "is for a"), [1])
+        self.assertIn("is", zt._search_cache["subject"])
+        zt._tickets = {5: tickets[0]}
+        self.assertEqual(zt._search_text("subject", "is"), [5])
+
+    def test_search_text_cache_update(self):
+        """
+        This test confirms that after an incremental update, the _search_text method
+        keeps the cached results of search terms that no changed ticket contains, and
+        discards those found in the old or new text of a changed ticket.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = dict(tickets)
+        self.assertEqual(zt._search_text("subject", "zen"), [0])
+        self.assertEqual(zt._search_text("subject", "apple"), [1])
+        self.assertEqual(zt._search_text("subject", "avocado"), [])
+        previous = zt._tickets
+        zt._tickets = dict(previous)
+        zt._tickets[1] = dict(previous[1], subject="a is for avocado")
+        zt._update_indexes(previous, {1: None})
+        self.assertEqual(list(zt._search_cache["subject"]), ["zen"])
+        self.assertEqual(zt._search_text("subject", "apple"), [])
+        self.assertEqual(zt._search_text("subject", "avocado"), [1])
+
+    def test_sync_tickets_last_sync(self):
+        """
+        This test confirms that the _sync_tickets method takes the last sync time from
+        Zendesk's clock, not the local one: from the newest ticket update of a full listing,
+        then from the end_time reported by the incremental export, and that each export
+        starts a minute before the last sync time.
+        """
+        class Ticket:
+            id = 1
+            status = "open"
+
+            def to_dict(self):
+                return {"requester_id": 2, "assignee_id": 3, "subject": "s", "description": "d",
+                        "tags": [], "updated_at": "2021-10-01T12:00:00Z"}
+
+        class Export(list):
+            end_time = 1633100000
+
+        class Tickets:
+            def __init__(self):
+                self.start_times = []
+
+            def __call__(self, **kwargs):
+                return [Ticket()]
+
+            def incremental(self, start_time):
+                self.start_times.append(start_time)
+                return Export()
+
+        zt = ZendeskTicket()
+        zt._client = client = type("Client", (), {"tickets": Tickets()})()
+        zt._sync_tickets()
+        self.assertIn(zt._last_sync, (1633089600, 1633089599))     # the listing may take up to a second
+        last_sync = zt._last_sync
+        zt._sync_tickets()
+        self.assertEqual(client.tickets.start_times, [last_sync - 60])
+        self.assertEqual(zt._last_sync, 1633100000)
+
+    def test_save_and_load_cache(self):
+        """
+        This test confirms that given a sample ticket dictionary (attached),
+        the tickets and last sync time written by _save_cache are restored
+        by _load_cache on a new ZendeskTicket object.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.object(ZendeskCodingChallenge, "CACHE_FILE", os.path.join(directory, "cache.json")):
+                zt = ZendeskTicket()
+                zt._tickets = tickets
+                zt._last_sync = 1633046400
+                zt._save_cache()
+                restored = ZendeskTicket()
+                restored._load_cache()
+        self.assertEqual(restored._tickets, tickets)
+        self.assertEqual(restored._last_sync, 1633046400)
+
+    def test_load_cache_fields_changed(self):
+        """
+        This test confirms that the _load_cache method ignores a cache file written
+        for a different list of DESIRED_FIELDS, since its tickets lack the new fields.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.object(ZendeskCodingChallenge, "CACHE_FILE", os.path.join(directory, "cache.json")):
+                zt = ZendeskTicket()
+                zt._tickets = tickets
+                zt._last_sync = 1633046400
+                zt._save_cache()
+                with patch.object(ZendeskCodingChallenge, "DESIRED_FIELDS",
+                                  ZendeskCodingChallenge.DESIRED_FIELDS + ("status",)):
+                    restored = ZendeskTicket()
+                    restored._load_cache()
+        self.assertIsNone(restored._tickets)
+        self.assertIsNone(restored._last_sync)
+
+    def test_format_key_display(self):
+        """
+        This test confirms that the format_key_display function titles the key,
+        replaces underscores, and pads the label so that data starts at the same column.
+        """
+        self.assertEqual(format_key_display("requester_id"), "Requester Id:   ")
+        self.assertEqual(format_key_display("tags"), "Tags:           ")
+        self.assertEqual(len(format_key_display("description")), 16)
+
+    def test_format_page(self):
+        """
+        This test confirms that the _format_page method fills each ticket into the
+        ticket template, with every field rendered after its header.
+        """
+        zt = ZendeskTicket()
+        zt._tickets = {7: {"requester_id": 11, "assignee_id": None, "subject": "Printer jam",
+                           "description": "Paper stuck", "tags": ["hw", "urgent"],
+                           "API_timestamp": "Zendesk API Called: now"}}
+        page = zt._format_page([7])
+        self.assertTrue(page.startswith("[Ticket ID #7]\nRequester Id:   11\nAssignee Id:    None\n"))
+        self.assertIn("Subject:        Printer jam\n\nDescription:    \nPaper stuck\n\n", page)
+        self.assertIn("Tags:           hw, urgent \n \nZendesk API Called: now\n", page)
+        self.assertTrue(page.endswith(ZendeskCodingChallenge.TICKET_BREAK + "\n"))
+
+    def test_get_tickets_ttl(self):
+        """
+        This test confirms that the get_tickets method makes no API call while the
+        local data is fresh, and makes one when forced or after invalidate().
+        """
+        zt = ZendeskTicket()
+        zt._tickets = tickets
+        zt._fetched_at = ZendeskCodingChallenge.monotonic()
+        with patch.object(ZendeskTicket, "_sync_tickets") as sync, \
+                patch.object(ZendeskTicket, "_save_cache"):
+            zt.get_tickets()
+            self.assertEqual(sync.call_count, 0)
+            zt.get_tickets(force=True)
+            self.assertEqual(sync.call_count, 1)
+            zt.invalidate()
+            zt.get_tickets()
+            self.assertEqual(sync.call_count, 2)
+
+    def test_get_tickets_retry(self):
+        """
+        This test confirms that the get_tickets method retries a Zendesk API call that
+        fails with a rate limit (429) or server (5xx) APIException, waiting as long as the
+        Retry-After header asks or backing off exponentially, and does not retry a
+        login failure (401).
+        """
+        class Response:
+            def __init__(self, status_code, headers):
+                self.status_code = status_code
+                self.headers = headers
+
+        class Ticket:
+            id = 1
+            status = "open"
+
+            def to_dict(self):
+                return {"requester_id": 2, "assignee_id": 3, "subject": "s", "description": "d", "tags": []}
+
+        class Client:
+            def __init__(self, failures):
+                self.failures = list(failures)
+                self.calls = 0
+
+            def tickets(self, **kwargs):
+                self.calls += 1
+                if self.failures:
+                    raise self.failures.pop(0)
+                return [Ticket()]
+
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(ZendeskCodingChallenge, "CACHE_FILE", os.path.join(directory, "cache.json")), \
+                patch.object(ZendeskCodingChallenge, "uniform", return_value=0.5), \
+                patch.object(ZendeskCodingChallenge, "sleep") as sleep, \
+                patch("builtins.print") as output:
+            zt = ZendeskTicket()
+            zt._client = client = Client([APIException("rate limited", response=Response(429, {"Retry-After": "7"})),
+                                          APIException("unavailable", response=Response(503, {}))])
+            zt.get_tickets()
+            self.assertEqual(client.calls, 3)
+            self.assertEqual([call.args[0] for call in sleep.call_args_list], [7, 2.5])
+            self.assertEqual([call.args[0] for call in output.call_args_list],
+                             ["The Zendesk API call failed; retrying in 7 seconds.",
+                              "The Zendesk API call failed; retrying in 3 seconds."])
+            self.assertEqual(list(zt._tickets), [1])
+
+            sleep.reset_mock()
+            os.remove(ZendeskCodingChallenge.CACHE_FILE)    # start the second object without cached tickets
+            zt = ZendeskTicket()
+            zt._client = client = Client([APIException("unauthorized", response=Response(401, {}))])
+            zt.get_tickets()
+            self.assertEqual(client.calls, 1)
+            sleep.assert_not_called()
+            self.assertEqual(zt._tickets, {})